@@ -1,16 +1,51 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from openai import OpenAI
+from openai import OpenAI, OpenAIError
+import httpx
+import orjson
 import os
+import threading
+import time
+from collections import deque
+import redis
 from dotenv import load_dotenv
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+from prompts import STAGE_PROMPTS
+from cachetools import TTLCache
+from batching import MicroBatcher
+from token_bucket import TOKEN_BUCKET_LUA
 
 # 加载环境变量
 load_dotenv()
 
+# 用 orjson 替换 Flask 默认的 JSON 实现：request.get_json() 和 jsonify() 都会走这里，
+# 序列化直接得到 bytes，省掉一次 encode。
+# 调用方传了 json.dumps / json.loads 专用参数（sort_keys、indent 等）时交回 Flask 默认实现，
+# orjson 不认识的类型仍由 Flask 的 default 处理
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # 与 jsonify() 的约定一致：单个参数原样序列化，多个参数当列表，关键字参数当字典
+        if args and kwargs:
+            raise TypeError("jsonify() behavior undefined when passed both args and kwargs")
+        obj = args[0] if len(args) == 1 else (list(args) if args else kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # --- 1. 数据库连接配置 ---
@@ -20,37 +55,89 @@ mongo_uri = os.environ.get("MONGO_URI")
 # 链接数据库
 if mongo_uri:
     try:
-        mongo_client = MongoClient(mongo_uri)
+        # 连接池按线程 worker 的规模设置；超时调短，数据库不可达时请求几秒内就失败，而不是默认卡 30 秒
+        mongo_client = MongoClient(
+            mongo_uri,
+            maxPoolSize=20,
+            minPoolSize=2,
+            serverSelectionTimeoutMS=1500,
+            socketTimeoutMS=2000,
+            retryWrites=True
+        )
         # 'exam_db' 是库名，'tokens' 是集合名，MongoDB会自动创建它们
         tokens_collection = mongo_client['exam_db']['tokens']
-        print("✅ MongoDB 连接成功")
     except Exception as e:
         print(f"❌ MongoDB 连接失败: {e}")
         tokens_collection = None
+
+    # MongoClient 本身不会真正连接，启动时 ping 一次确认数据库可用。
+    # ping 失败只打日志、保留客户端：驱动会在数据库恢复后自动重连，不能因为部署时的短暂故障让卡密功能一直不可用
+    if tokens_collection is not None:
+        try:
+            tokens_collection.database.command("ping")
+            print("✅ MongoDB 连接成功")
+        except PyMongoError as e:
+            print(f"⚠️ MongoDB 暂时不可达，将在后续请求时自动重连: {e}")
 else:
     print("⚠️ 警告: 未设置 MONGO_URI，运行在无数据库模式（卡密功能将不可用）")
     tokens_collection = None
 
 # --- 2. 辅助函数：卡密管理 ---
+# 卡密查询和扣减都按 token 过滤，建唯一索引避免全表扫描（索引已存在时是空操作）。
+# 数据库暂时不可达时不算完成，下一次扣费时再试；已有重复卡密这类重试也没用的错误只记录一次
+token_index_ready = False
+
+def ensure_token_index():
+    global token_index_ready
+    if token_index_ready or tokens_collection is None:
+        return
+    try:
+        tokens_collection.create_index("token", unique=True)
+    except OperationFailure as e:
+        print(f"⚠️ token 索引创建失败（可能存在重复卡密）: {e}")
+    except PyMongoError as e:
+        print(f"⚠️ token 索引暂未创建，稍后重试: {e}")
+        return
+    token_index_ready = True
+
+# 限流器每个请求都要查一次卡密余额，短时间内缓存查询结果，同一卡密的连续请求不必每次都访问 MongoDB
+quota_cache = TTLCache(maxsize=10_000, ttl=2)
+quota_cache_lock = threading.Lock()
+
 def get_token_quota(token):
-    """查询卡密剩余次数，如果是新卡密(特定前缀)则自动创建"""
+    """查询卡密剩余次数（带短时缓存）"""
     if tokens_collection is None:
         return 0
     
-    # 1. 查库
-    record = tokens_collection.find_one({"token": token})
-    if record:
-        return record['quota']
+    with quota_cache_lock:
+        quota = quota_cache.get(token)
+    if quota is not None:
+        return quota
     
-    return 0 # 不符合规则的卡密无效
-
-def decrement_token_quota(token):
-    """扣除一次机会"""
-    if tokens_collection is not None:
-        tokens_collection.update_one(
-            {"token": token},
-            {"$inc": {"quota": -1}}
-        )
+    # 1. 查库
+    record = tokens_collection.find_one({"token": token}, {"_id": 0, "quota": 1})
+    quota = record['quota'] if record else 0 # 不符合规则的卡密无效
+    with quota_cache_lock:
+        quota_cache[token] = quota
+    return quota
+
+def consume_token(token):
+    """原子地扣除一次机会：只有余额 > 0 时才扣，返回扣除前的记录；卡密无效或次数已用完返回 None。
+    查询和扣减在同一次数据库操作里完成，并发请求不会都通过余额检查"""
+    if tokens_collection is None:
+        return None
+    ensure_token_index()
+    record = tokens_collection.find_one_and_update(
+        {"token": token, "quota": {"$gt": 0}},
+        {"$inc": {"quota": -1}},
+        projection={"_id": 0, "quota": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    with quota_cache_lock:
+        quota_cache[token] = max(0, record['quota'] - 1) if record else 0
+    return record
+
+ensure_token_index()
 
 # --- 3. 配置限流器逻辑 ---
 def get_rate_limit_key():
@@ -61,195 +148,267 @@ def get_rate_limit_key():
             # 只有当卡密真实有效且有余额时，才给予“特权”绕过 IP 限制
             if get_token_quota(token) > 0:
                 return None 
-    except:
+    except Exception:
         pass
     return get_remote_address()
 
+# 设置 REDIS_URL 后计数存在 Redis 里，多个 worker / 多个实例共享同一份额度；
+# 没设置时退回进程内存（每个 worker 各算各的）
+redis_url = os.environ.get("REDIS_URL")
+
 limiter = Limiter(
     key_func=get_rate_limit_key,
     app=app,
-    storage_uri="memory://" 
+    storage_uri=redis_url or "memory://",
+    strategy="moving-window",
+    # Redis 不可用时不让限流器把请求变成 500：放行并打日志，和下面的令牌桶一样降级
+    swallow_errors=True
 )
 
+# 卡密用户不受 IP 限制，但用令牌桶防止单个卡密瞬间刷爆接口：
+# 桶容量 TOKEN_BURST 次，每分钟回填 TOKEN_REFILL_PER_MINUTE 次。
+# 读取、回填、扣减、写回、续期在同一个 Lua 脚本里完成（见 token_bucket.py），一次往返且多个 worker 之间无竞争
+TOKEN_BURST = int(os.environ.get("TOKEN_BURST", 5))
+TOKEN_REFILL_PER_MINUTE = float(os.environ.get("TOKEN_REFILL_PER_MINUTE", 2))
+
+# 多人共用的占位卡密：前端没填卡密时会发送 "guest"。
+# 这类卡密的令牌桶按 IP 分开，否则所有匿名访客会挤在同一个桶里
+SHARED_TOKENS = {"guest"}
+
+if redis_url:
+    redis_client = redis.Redis.from_url(redis_url)
+    token_bucket = redis_client.register_script(TOKEN_BUCKET_LUA)
+else:
+    token_bucket = None
+
+def allow_token_request(stage_type, token):
+    """卡密令牌桶检查；没有 Redis 或 Redis 出错时放行"""
+    if token_bucket is None:
+        return True
+    subject = f"{token}-{get_remote_address()}" if token in SHARED_TOKENS else token
+    try:
+        rate_per_ms = TOKEN_REFILL_PER_MINUTE / 60000
+        now_ms = int(time.time() * 1000)
+        return token_bucket(keys=[f"rl-{stage_type}-{subject}"], args=[TOKEN_BURST, rate_per_ms, now_ms]) == 1
+    except redis.RedisError as e:
+        print(f"⚠️ 令牌桶检查失败，已放行: {e}")
+        return True
+
 # --- 4. 配置 OpenAI ---
 api_key = os.environ.get("OPENAI_API_KEY") 
-client = OpenAI(api_key=api_key)
+# 连接池大小与 gunicorn 线程数一致（见 gunicorn.conf.py），每个线程都能拿到一条上游连接。
+# 开启 HTTP/2 并保持长连接：并发请求复用同一条 TLS 连接，不必每次重新握手
+openai_max_connections = int(os.environ.get("GUNICORN_THREADS", 32))
+client = OpenAI(
+    api_key=api_key,
+    http_client=httpx.Client(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=openai_max_connections,
+            max_keepalive_connections=openai_max_connections,
+            keepalive_expiry=60
+        )
+    )
+)
 
 # --- 5. 定义 Prompts  ---
-STAGE1_PROMPT = """
-You are a content developer for high-stakes English exams (IELTS/PTE).
-Generate a JSON object with **8 distinct reading items**.
-
-### 1. CRITICAL LENGTH OVERRIDE (READ CAREFULLY):
-- **Problem**: Previous outputs were too short (only 120 words).
-- **Requirement**: Each passage MUST be **180-200 words** long.
-- **Strategy**: You must be **VERBOSE**. Do not summarize. Elaborate on every point.
-- **Sentence Count**: **16-20 sentences** per passage. (Use compound-complex sentences).
-
-### 2. MANDATORY STRUCTURE (To ensure length):
-You MUST follow this "5-Step Expansion" formula for EVERY passage to guarantee word count:
-1.  **The Hook & Definition (3-4 sentences)**: Introduce the concept with rich sensory or descriptive details. Define it thoroughly.
-2.  **The Context/History (3-4 sentences)**: Explain how this was viewed in the past (e.g., "In the Victorian era...", "Previously, scientists believed..."). Provide a specific (fictional or real) date/era.
-3.  **The "But" (The Pivot) (3-4 sentences)**: Introduce the complication, new evidence, or modern problem. Use transition phrases like "However," "Conversely," or "Despite this."
-4.  **The Specific Evidence (3-4 sentences)**: Cite a specific study/event. Describe the *methodology* or *specific details* of the event, not just the result. (Remember: Use specific names in max 2 passages; use generalized attribution for the rest).
-5.  **The Implication (3-4 sentences)**: Explain the long-term consequences on society, nature, or the individual.
-
-### 3. TOPICS (Mix these):
-- Animal Behavior (e.g., mimicry, migration patterns).
-- Urban Planning (e.g., gentrification, smart cities).
-- Cognitive Psychology (e.g., memory, perception bias).
-- Environmental Science (e.g., soil erosion, microplastics).
-- History of Technology (e.g., the telegraph, steam engine).
-
-### 4. QUESTION TYPES (Standardized):
-Randomly assign ONE question type per passage:
-- "What is the main point that the writer is making in this passage?"
-- "What would make the best heading for this paragraph?"
-- "What is the writer doing in this passage?"
-- "What conclusion can the reader make from this passage?"
-
-### 5. OPTION GENERATION (HARD MODE):
-- **Correct Answer**: Paraphrase using synonyms.
-- **Distractor 1 (Too Narrow)**: True detail, but not the main point.
-- **Distractor 2 (Too Strong)**: Uses absolute words (always, never, solely).
-- **Distractor 3 (Not Given)**: Plausible academic statement, but not in text.
-
-### 6. OUTPUT FORMAT:
-Return ONLY valid JSON.
-{
-  "exam_set": [
-    {
-      "passage": "Full text (approx 250 words)...",
-      "question": "Question text...",
-      "options": ["Option A", "Option B", "Option C", "Option D"],
-      "correct": 0
-    },
-    ...
-  ]
-}
-"""
-
-STAGE2_PROMPT = """
-You are a strict exam content creator for Academic English Purposes (EAP) 
-Generate a "Matching Headings" task based on a single cohesive academic article.
-
-### 1. ARTICLE STRUCTURE:
-- Topic: Academic (e.g., Architecture, Environmental Science, History, Linguistics).
-- Length: Total 600-700 words.
-- Structure: Split the article into **7 Sections** (labeled A, B, C, D, E, F, G).
-- Each section must have a distinct "Main Idea".
-
-### 2. HEADINGS GENERATION (The Puzzle):
-- Generate **9 Headings** (labeled i to ix).
-- **7 Headings** must be the correct titles for sections A-G.
-- **2 Headings** must be **Distractors** (plausible but incorrect, or minor details).
-- The headings should be short, distinct summaries (e.g., "The financial impact of...", "Early failures in design").
-
-### 3. OUTPUT FORMAT (Strict JSON):
-{
-  "title": "Article Title",
-  "headings": {
-    "i": "Heading text...",
-    "ii": "Heading text...",
-    ... (up to ix)
-  },
-  "sections": [
-    {
-      "id": "A",
-      "text": "Full text of section A...",
-      "correct_heading": "iii" // The roman numeral of the correct answer
-    },
-    ... (Repeat for B, C, D, E, F, G)
-  ]
-}
-"""
-
-STAGE3_PROMPT = """
-You are a strict exam content creator for Academic English Purposes (EAP)
-Generate a "Locating Information" task based on a single cohesive academic article.
-
-### 1. ARTICLE STRUCTURE:
-- Topic: Academic (e.g., Psychology, Biology, Economics, History).
-- Length: Total 650-750 words.
-- Structure: Split the article into **7 Sections** (labeled A, B, C, D, E, F, G).
-
-### 2. QUESTIONS GENERATION (The Task):
-- Generate **7 Statements** describing specific information found in the text.
-- Format examples: "a reason why...", "a list of...", "a mention of...", "evidence that...".
-- **CRITICAL**: 
-    - Some sections might contain answers to multiple questions.
-    - Some sections might not be used at all.
-    - But ensure all 7 questions have a valid answer in the text.
-
-### 3. OUTPUT FORMAT (Strict JSON):
-{
-  "title": "Article Title",
-  "questions": [
-    {
-      "id": 1,
-      "text": "a mention of the initial failure...",
-      "correct_section": "B" 
-    },
-    ... (repeat for 7 questions)
-  ],
-  "sections": [
-    {
-      "id": "A",
-      "text": "Full text of section A..."
-    },
-    ... (Repeat for B, C, D, E, F, G)
-  ]
+# Prompt 正文在 prompts.py；这里预先拼好每个阶段的 messages 和固定请求参数，
+# 每次请求只需一次字典查找，不再分支判断、重新构造。
+# 整段出题要求放在 system 消息里作为固定前缀，user 消息只有一句固定的话：
+# 每次请求的前缀逐字节相同，前缀达到 1024 个 token 时 OpenAI 会自动命中 prompt 缓存，
+# 跳过这部分的预填充计算（实际命中情况见 call_openai 打印的 cached tokens）
+PROMPTS = {
+    stage: (
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": "Generate now."},
+    )
+    for stage, prompt in STAGE_PROMPTS.items()
 }
-"""
-
-STAGE4_PROMPT = """
-You are a strict exam content creator for Academic English Purposes (EAP)
-Generate a "Gapped Text" task.
-
-### 1. ARTICLE STRUCTURE:
-- Topic: Academic/General Interest (e.g., Psychology, Sociology, Biology).
-- Length: Long (800-900 words).
-- The text must have logical flow.
-
-### 2. TASK GENERATION:
-- Remove **6 whole paragraphs** (or significant logical chunks) from the text.
-- Replace them in the text with markers: [[1]], [[2]], [[3]], [[4]], [[5]], [[6]].
-- Provide a list of **7 Paragraphs** (Options A-G).
-    - 6 are the correct removed paragraphs.
-    - 1 is a **Distractor** (does not fit anywhere).
-
-### 3. OUTPUT FORMAT (Strict JSON):
-{
-  "title": "Article Title",
-  "base_text": "Full text with markers [[1]], [[2]]... inside.",
-  "options": [
-    { "id": "A", "text": "Content of paragraph A..." },
-    { "id": "B", "text": "Content of paragraph B..." },
-    ... (Up to G)
-  ],
-  "answers": {
-    "1": "C",
-    "2": "A",
-    "3": "F",
-    "4": "B",
-    "5": "G",
-    "6": "D"
-  }
+REQUEST_KW = {
+    "response_format": { "type": "json_object" },
+    "temperature": 0.7
 }
-"""
 
-# --- 6. 核心路由定义 ---
+# 默认用 gpt-4o-mini。更贵更慢的模型只开放给有效的个人卡密（不含 guest 这类共用卡密），
+# 匿名 / 共用卡密的请求只能用 FREE_MODELS
+DEFAULT_MODEL = "gpt-4o-mini"
+FREE_MODELS = {"gpt-4o-mini"}
+TOKEN_MODELS = {"gpt-4o-mini", "gpt-4o"}
+
+# 限制输出长度，避免个别请求一直生成到上下文上限、拖长尾延迟。
+# 阶段一（8 篇 180-250 词短文 + 题目和 4 个选项，约 3000-3400 token）和
+# 阶段四（800-900 词长文 + 7 段选项）输出最长，留足余量。
+# 被截断（finish_reason == "length"）的输出是不完整的 JSON，一律丢弃，不会发给用户或放进题库
+MAX_TOKENS = {stage: 2400 for stage in PROMPTS}
+MAX_TOKENS['stage1'] = 5000
+MAX_TOKENS['stage4'] = 4096
+# 流式响应一旦发出 200 就无法再丢弃截断的输出，所以流式请求直接用模型的输出上限，
+# 实际上不会被 max_tokens 截断
+STREAM_MAX_TOKENS = 16384  # gpt-4o / gpt-4o-mini 的最大输出长度
+
+# --- 6. 题目生成与预生成题库 ---
+def call_openai(stage_type, n=1, model=DEFAULT_MODEL, seed=None):
+    """按阶段调用 OpenAI，一次生成 n 套互不相同的题，返回 JSON 字符串列表"""
+    response = client.chat.completions.create(
+        messages=PROMPTS[stage_type],
+        model=model,
+        max_tokens=MAX_TOKENS[stage_type],
+        seed=seed,
+        n=n,
+        **REQUEST_KW
+    )
+    usage = response.usage
+    if usage and usage.prompt_tokens_details:
+        print(f"[{stage_type}] prompt tokens: {usage.prompt_tokens}, cached: {usage.prompt_tokens_details.cached_tokens}")
+    contents = []
+    for choice in response.choices:
+        if choice.finish_reason == "length":
+            print(f"⚠️ [{stage_type}] 输出达到 max_tokens 被截断，已丢弃")
+            continue
+        contents.append(choice.message.content)
+    if not contents:
+        raise OpenAIError(f"[{stage_type}] completion truncated at max_tokens")
+    return contents
+
+def stream_openai(stage_type, model=DEFAULT_MODEL, seed=None):
+    """流式生成一套题：先发起调用（连接类错误在这里直接抛出），返回逐块产出 JSON 文本的生成器。
+    客户端收到的是同一个 JSON 对象的分段，需要接收完整后再解析；
+    上游中途出错时响应体不完整，客户端 JSON 解析会失败，应当按生成失败处理"""
+    stream = client.chat.completions.create(
+        messages=PROMPTS[stage_type],
+        model=model,
+        max_tokens=STREAM_MAX_TOKENS,
+        seed=seed,
+        stream=True,
+        **REQUEST_KW
+    )
+
+    def generate():
+        # 客户端中途断开时 Werkzeug 会关闭这个生成器，with 保证上游连接随之关闭。
+        # 响应头已经发出，中途出错无法再改状态码，只能记录日志（客户端会收到不完整的 JSON）
+        with stream:
+            try:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    if chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                    if chunk.choices[0].finish_reason == "length":
+                        print(f"⚠️ [{stage_type}] 流式输出达到 max_tokens 被截断")
+            except (OpenAIError, httpx.HTTPError) as e:
+                print(f"Error: [{stage_type}] 流式生成中断: {e}")
+
+    return generate()
+
+# 每个阶段的 prompt 都是固定的，直接缓存一份结果会让所有人拿到同一套题。
+# 所以每个阶段预先生成几套不同的题放进池子，请求来时取走一套（每套只发给一个人），
+# 再由后台线程补齐，用户就不用等 OpenAI 现场生成。设为 0 关闭。
+# 注意成本：题库在每个 worker 进程里各有一份，每个 worker 启动时都会预生成
+# 4 个阶段 × EXAM_POOL_SIZE 套题并计费，总量再乘以 WEB_CONCURRENCY（和实例数）
+# 题库只存默认模型、不指定 seed 生成的题
+EXAM_POOL_SIZE = int(os.environ.get("EXAM_POOL_SIZE", 2))
+exam_pools = {stage: deque() for stage in PROMPTS}
+
+# 每个阶段同一时间只允许一个补货线程（single-flight）：
+# 并发取题会连续触发补货，如果各自调用 OpenAI，题库会被重复补满、重复计费
+refilling = set()
+refill_lock = threading.Lock()
+
+def refill_exam_pool(stage_type):
+    """把某个阶段的题库补到 EXAM_POOL_SIZE 套；补货期间又被取走的题也会一并补上"""
+    pool = exam_pools[stage_type]
+    done = False
+    try:
+        while not done:
+            while len(pool) < EXAM_POOL_SIZE:
+                pool.extend(call_openai(stage_type, n=EXAM_POOL_SIZE - len(pool)))
+            # 在锁内再确认一次再退出：补满之后、退出之前被取走的题，
+            # 取题方看到补货仍在进行不会再触发补货，所以这里必须接着补
+            with refill_lock:
+                if len(pool) >= EXAM_POOL_SIZE:
+                    refilling.discard(stage_type)
+                    done = True
+    except OpenAIError as e:
+        print(f"⚠️ 题库预生成失败 [{stage_type}]: {e}")
+    finally:
+        if not done:
+            with refill_lock:
+                refilling.discard(stage_type)
+
+def schedule_refill(stage_type):
+    if EXAM_POOL_SIZE <= 0:
+        return
+    with refill_lock:
+        if stage_type in refilling:
+            return
+        refilling.add(stage_type)
+    threading.Thread(target=refill_exam_pool, args=(stage_type,), daemon=True).start()
+
+def take_pooled_exam(stage_type):
+    """从题库取出一套题；题库为空返回 None。无论是否命中都触发后台补货"""
+    try:
+        return exam_pools[stage_type].popleft()
+    except IndexError:
+        return None
+    finally:
+        schedule_refill(stage_type)
+
+# 启动时先把各阶段题库填上
+for _stage in exam_pools:
+    schedule_refill(_stage)
+
+# 题库空了、多个用户同时现场生成同一阶段时，把 BATCH_MAX_WAIT 秒内到达的请求
+# （最多 BATCH_MAX_SIZE 个）合并成一次 n=批大小 的 OpenAI 调用，每人分到其中一个 choice。
+# 只有阶段、模型、seed 都相同的请求才会合并到同一批。
+# 合并逻辑见 batching.py
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT = float(os.environ.get("BATCH_MAX_WAIT", 0.02))
+
+def dispatch_batch(batch_key, n):
+    stage_type, model, seed = batch_key
+    return call_openai(stage_type, n=n, model=model, seed=seed)
+
+exam_batcher = MicroBatcher(
+    dispatch_batch,
+    max_size=BATCH_MAX_SIZE,
+    max_wait=BATCH_MAX_WAIT,
+    short_error=lambda: OpenAIError("OpenAI returned fewer choices than requested")
+)
+
+def call_openai_batched(stage_type, model=DEFAULT_MODEL, seed=None):
+    """现场生成一套题，与同一时间窗口内阶段、模型、seed 相同的其它请求合并为一次调用"""
+    return exam_batcher.submit((stage_type, model, seed))
+
+# --- 7. 核心路由定义 ---
 @app.route('/generate-exam', methods=['POST']) 
 @limiter.limit("2 per minute")
 @limiter.limit("50 per day")
 def generate_exam():
     try:
         data = request.get_json(silent=True)
-        if not data:
+        if not data or not isinstance(data, dict):
             return jsonify({"error": "Invalid JSON"}), 400
 
         stage_type = data.get('stage', 'stage1') 
-        token = data.get('token', '').strip()
+        token = data.get('token', '')
+        model = data.get('model', DEFAULT_MODEL)
+        # 客户端传入的字段类型不对时返回 400，而不是在后面的 strip() / 字典查找里抛异常变成 500
+        if not all(isinstance(value, str) for value in (stage_type, token, model)):
+            return jsonify({"error": "stage, token and model must be strings"}), 400
+
+        if stage_type not in PROMPTS:
+            stage_type = 'stage1'
+        token = token.strip()
+        
+        if model not in TOKEN_MODELS:
+            return jsonify({"error": f"Unsupported model: {model}"}), 400
+        # 卡密本身是否有效在下面扣费时校验；无效卡密会在那里返回 403
+        if model not in FREE_MODELS and (not token or token in SHARED_TOKENS):
+            return jsonify({"error": f"Model {model} requires a personal access token"}), 403
+        # 指定 seed 时 OpenAI 会尽量复现同样的输出
+        seed = data.get('seed')
+        if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+            return jsonify({"error": "seed must be an integer"}), 400
         
         quota_remaining = "IP Limit"
 
@@ -258,42 +417,48 @@ def generate_exam():
             if tokens_collection is None:
                 return jsonify({"error": "Server Database Error (Contact Admin)"}), 500
             
-            # 2. 获取当前剩余次数
-            current_quota = get_token_quota(token)
+            # 1. 先用带缓存的余额查询挡掉无效卡密，不让它们占用令牌桶、在 Redis 里创建 key
+            if get_token_quota(token) <= 0:
+                return jsonify({"error": "无效卡密或次数已用完 (Invalid or Exhausted Token)"}), 403
+            
+            if not allow_token_request(stage_type, token):
+                return jsonify({"error": "卡密请求过于频繁，请稍后再试。"}), 429
             
-            # 3. 如果次数不足
-            if current_quota <= 0:
+            # 2. 校验并扣除一次次数（一次原子操作）
+            record = consume_token(token)
+            
+            # 3. 如果卡密无效或次数不足
+            if record is None:
                 return jsonify({"error": "无效卡密或次数已用完 (Invalid or Exhausted Token)"}), 403
             
-            # 4. 扣除一次次数
-            decrement_token_quota(token)
-            quota_remaining = current_quota - 1
+            quota_remaining = record['quota'] - 1
             print(f"Token [{token}] used. Remaining in DB: {quota_remaining}")
         
         # === 生成逻辑 ===
-        current_prompt = STAGE1_PROMPT
-        if stage_type == 'stage2':
-            current_prompt = STAGE2_PROMPT
-        elif stage_type == 'stage3': 
-            current_prompt = STAGE3_PROMPT
-        elif stage_type == 'stage4': 
-            current_prompt = STAGE4_PROMPT
-
-        response = client.chat.completions.create(
-            model="gpt-4o", 
-            messages=[{"role": "user", "content": current_prompt}],
-            response_format={ "type": "json_object" },
-            temperature=0.7 
-        )
-        content = response.choices[0].message.content
+        # 优先从预生成题库里取一套，题库空了才现场调用 OpenAI
+        content = None
+        if model == DEFAULT_MODEL and seed is None:
+            content = take_pooled_exam(stage_type)
+        # 请求里带 "stream": true 时，边生成边返回，首字节不用等整套题生成完
+        if content is None:
+            if data.get('stream'):
+                content = stream_openai(stage_type, model, seed)
+            else:
+                content = call_openai_batched(stage_type, model, seed)
         
-        return content, 200, {'X-Remaining-Quota': str(quota_remaining)}
-
-    except Exception as e:
+        # content 已经是 OpenAI 返回的 JSON 字符串（或其分段），直接原样返回并标注 application/json。
+        # 每套题只发给一个人且会扣次数，不允许任何缓存
+        return Response(content, status=200, mimetype='application/json', headers={
+            'X-Remaining-Quota': str(quota_remaining),
+            'Cache-Control': 'no-store'
+        })
+
+    # 只处理上游 / 数据库错误；其它异常属于代码问题，交给 Flask 记录完整堆栈并返回 500
+    except (OpenAIError, PyMongoError) as e:
         print(f"Error: {e}")
         return jsonify({"error": str(e)}), 500
 
-# --- 7. 错误处理 ---
+# --- 8. 错误处理 ---
 @app.errorhandler(429)
 def ratelimit_handler(e):
     return jsonify({
@@ -301,5 +466,8 @@ def ratelimit_handler(e):
         "detail": str(e.description)
     }), 429
 
+# 仅供本地开发：`python app.py`。线上用 gunicorn 启动（配置见 gunicorn.conf.py）。
+# 调试模式（重载器 + 交互调试器）只在 FLASK_DEBUG=1 时开启：重载器会把模块导入两遍，
+# 重复创建 MongoDB / OpenAI 客户端和后台补货线程
 if __name__ == '__main__':
-    app.run(port=5000, debug=True)
\ No newline at end of file
+    app.run(port=int(os.environ.get("PORT", 5000)), debug=os.environ.get("FLASK_DEBUG") == "1")
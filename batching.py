@@ -0,0 +1,52 @@
+# 请求合并（micro-batching）：把同一时间窗口内 key 相同的请求合并成一次批量调用。
+# 第一个到达的请求（leader）负责等待凑批并发起调用，其余请求等它分发结果。
+# 不依赖 Flask / OpenAI，方便单独测试
+import threading
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    def __init__(self, call, max_size, max_wait, short_error=None):
+        """call(key, n) 一次返回 n 个结果的列表；返回的结果少于 n 个时，
+        没分到结果的请求收到 short_error() 产生的异常"""
+        self.call = call
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.short_error = short_error or (lambda: RuntimeError("batch call returned fewer results than requested"))
+        self.open_batches = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key):
+        """加入 key 对应的批次并阻塞等待属于自己的那个结果；批量调用失败时抛出同一个异常"""
+        future = Future()
+        with self.lock:
+            batch = self.open_batches.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = self.open_batches[key] = {"futures": [], "full": threading.Event()}
+            batch["futures"].append(future)
+            if len(batch["futures"]) >= self.max_size:
+                del self.open_batches[key]
+                batch["full"].set()
+
+        if is_leader:
+            batch["full"].wait(self.max_wait)
+            with self.lock:
+                if self.open_batches.get(key) is batch:
+                    del self.open_batches[key]
+            self._dispatch(key, batch["futures"])
+
+        return future.result()
+
+    def _dispatch(self, key, futures):
+        try:
+            results = self.call(key, len(futures))
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for i, future in enumerate(futures):
+            if i < len(results):
+                future.set_result(results[i])
+            else:
+                future.set_exception(self.short_error())
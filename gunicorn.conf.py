@@ -0,0 +1,17 @@
+import os
+
+# gunicorn 启动时会自动读取当前目录下的这个文件: `gunicorn app:app`
+
+# Render 通过 PORT 环境变量指定端口
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+# /generate-exam 几乎全部时间都在等待 OpenAI 返回（I/O 密集），
+# 用 gthread 线程 worker 让一个进程同时挂起多个上游请求，
+# 而不是默认 sync worker 那样一个进程同一时间只能服务一个用户
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+
+# 不预加载应用：每个 worker fork 之后再各自导入 app.py，
+# 自己创建 MongoDB / Redis / OpenAI 连接（pymongo 的客户端不能跨 fork 共用）
+preload_app = False
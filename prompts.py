@@ -0,0 +1,171 @@
+# 四个阶段的出题 Prompt
+
+STAGE1_PROMPT = """
+You are a content developer for high-stakes English exams (IELTS/PTE).
+Generate a JSON object with **8 distinct reading items**.
+
+### 1. CRITICAL LENGTH OVERRIDE (READ CAREFULLY):
+- **Problem**: Previous outputs were too short (only 120 words).
+- **Requirement**: Each passage MUST be **180-200 words** long.
+- **Strategy**: You must be **VERBOSE**. Do not summarize. Elaborate on every point.
+- **Sentence Count**: **16-20 sentences** per passage. (Use compound-complex sentences).
+
+### 2. MANDATORY STRUCTURE (To ensure length):
+You MUST follow this "5-Step Expansion" formula for EVERY passage to guarantee word count:
+1.  **The Hook & Definition (3-4 sentences)**: Introduce the concept with rich sensory or descriptive details. Define it thoroughly.
+2.  **The Context/History (3-4 sentences)**: Explain how this was viewed in the past (e.g., "In the Victorian era...", "Previously, scientists believed..."). Provide a specific (fictional or real) date/era.
+3.  **The "But" (The Pivot) (3-4 sentences)**: Introduce the complication, new evidence, or modern problem. Use transition phrases like "However," "Conversely," or "Despite this."
+4.  **The Specific Evidence (3-4 sentences)**: Cite a specific study/event. Describe the *methodology* or *specific details* of the event, not just the result. (Remember: Use specific names in max 2 passages; use generalized attribution for the rest).
+5.  **The Implication (3-4 sentences)**: Explain the long-term consequences on society, nature, or the individual.
+
+### 3. TOPICS (Mix these):
+- Animal Behavior (e.g., mimicry, migration patterns).
+- Urban Planning (e.g., gentrification, smart cities).
+- Cognitive Psychology (e.g., memory, perception bias).
+- Environmental Science (e.g., soil erosion, microplastics).
+- History of Technology (e.g., the telegraph, steam engine).
+
+### 4. QUESTION TYPES (Standardized):
+Randomly assign ONE question type per passage:
+- "What is the main point that the writer is making in this passage?"
+- "What would make the best heading for this paragraph?"
+- "What is the writer doing in this passage?"
+- "What conclusion can the reader make from this passage?"
+
+### 5. OPTION GENERATION (HARD MODE):
+- **Correct Answer**: Paraphrase using synonyms.
+- **Distractor 1 (Too Narrow)**: True detail, but not the main point.
+- **Distractor 2 (Too Strong)**: Uses absolute words (always, never, solely).
+- **Distractor 3 (Not Given)**: Plausible academic statement, but not in text.
+
+### 6. OUTPUT FORMAT:
+Return ONLY valid JSON.
+{
+  "exam_set": [
+    {
+      "passage": "Full text (approx 250 words)...",
+      "question": "Question text...",
+      "options": ["Option A", "Option B", "Option C", "Option D"],
+      "correct": 0
+    },
+    ...
+  ]
+}
+"""
+
+STAGE2_PROMPT = """
+You are a strict exam content creator for Academic English Purposes (EAP) 
+Generate a "Matching Headings" task based on a single cohesive academic article.
+
+### 1. ARTICLE STRUCTURE:
+- Topic: Academic (e.g., Architecture, Environmental Science, History, Linguistics).
+- Length: Total 600-700 words.
+- Structure: Split the article into **7 Sections** (labeled A, B, C, D, E, F, G).
+- Each section must have a distinct "Main Idea".
+
+### 2. HEADINGS GENERATION (The Puzzle):
+- Generate **9 Headings** (labeled i to ix).
+- **7 Headings** must be the correct titles for sections A-G.
+- **2 Headings** must be **Distractors** (plausible but incorrect, or minor details).
+- The headings should be short, distinct summaries (e.g., "The financial impact of...", "Early failures in design").
+
+### 3. OUTPUT FORMAT (Strict JSON):
+{
+  "title": "Article Title",
+  "headings": {
+    "i": "Heading text...",
+    "ii": "Heading text...",
+    ... (up to ix)
+  },
+  "sections": [
+    {
+      "id": "A",
+      "text": "Full text of section A...",
+      "correct_heading": "iii" // The roman numeral of the correct answer
+    },
+    ... (Repeat for B, C, D, E, F, G)
+  ]
+}
+"""
+
+STAGE3_PROMPT = """
+You are a strict exam content creator for Academic English Purposes (EAP)
+Generate a "Locating Information" task based on a single cohesive academic article.
+
+### 1. ARTICLE STRUCTURE:
+- Topic: Academic (e.g., Psychology, Biology, Economics, History).
+- Length: Total 650-750 words.
+- Structure: Split the article into **7 Sections** (labeled A, B, C, D, E, F, G).
+
+### 2. QUESTIONS GENERATION (The Task):
+- Generate **7 Statements** describing specific information found in the text.
+- Format examples: "a reason why...", "a list of...", "a mention of...", "evidence that...".
+- **CRITICAL**: 
+    - Some sections might contain answers to multiple questions.
+    - Some sections might not be used at all.
+    - But ensure all 7 questions have a valid answer in the text.
+
+### 3. OUTPUT FORMAT (Strict JSON):
+{
+  "title": "Article Title",
+  "questions": [
+    {
+      "id": 1,
+      "text": "a mention of the initial failure...",
+      "correct_section": "B" 
+    },
+    ... (repeat for 7 questions)
+  ],
+  "sections": [
+    {
+      "id": "A",
+      "text": "Full text of section A..."
+    },
+    ... (Repeat for B, C, D, E, F, G)
+  ]
+}
+"""
+
+STAGE4_PROMPT = """
+You are a strict exam content creator for Academic English Purposes (EAP)
+Generate a "Gapped Text" task.
+
+### 1. ARTICLE STRUCTURE:
+- Topic: Academic/General Interest (e.g., Psychology, Sociology, Biology).
+- Length: Long (800-900 words).
+- The text must have logical flow.
+
+### 2. TASK GENERATION:
+- Remove **6 whole paragraphs** (or significant logical chunks) from the text.
+- Replace them in the text with markers: [[1]], [[2]], [[3]], [[4]], [[5]], [[6]].
+- Provide a list of **7 Paragraphs** (Options A-G).
+    - 6 are the correct removed paragraphs.
+    - 1 is a **Distractor** (does not fit anywhere).
+
+### 3. OUTPUT FORMAT (Strict JSON):
+{
+  "title": "Article Title",
+  "base_text": "Full text with markers [[1]], [[2]]... inside.",
+  "options": [
+    { "id": "A", "text": "Content of paragraph A..." },
+    { "id": "B", "text": "Content of paragraph B..." },
+    ... (Up to G)
+  ],
+  "answers": {
+    "1": "C",
+    "2": "A",
+    "3": "F",
+    "4": "B",
+    "5": "G",
+    "6": "D"
+  }
+}
+"""
+
+# 阶段名 -> Prompt，app.py 由这张表生成所有阶段相关的数据（消息、题库等），新增阶段只需改这里
+STAGE_PROMPTS = {
+    'stage1': STAGE1_PROMPT,
+    'stage2': STAGE2_PROMPT,
+    'stage3': STAGE3_PROMPT,
+    'stage4': STAGE4_PROMPT,
+}
@@ -0,0 +1,103 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import MicroBatcher
+
+
+class MicroBatcherTest(unittest.TestCase):
+    def test_concurrent_requests_share_one_call(self):
+        calls = []
+        started = threading.Barrier(5)
+
+        def call(key, n):
+            calls.append((key, n))
+            return [f"{key}-{i}" for i in range(n)]
+
+        # max_wait 足够长，最后一个请求到达时批次已满并立即发出
+        batcher = MicroBatcher(call, max_size=5, max_wait=5)
+
+        def submit(_):
+            started.wait()
+            return batcher.submit("stage1")
+
+        with ThreadPoolExecutor(5) as pool:
+            results = list(pool.map(submit, range(5)))
+
+        self.assertEqual(calls, [("stage1", 5)])
+        self.assertEqual(sorted(results), [f"stage1-{i}" for i in range(5)])
+
+    def test_leader_dispatches_partial_batch_after_max_wait(self):
+        calls = []
+
+        def call(key, n):
+            calls.append((key, n))
+            return ["only"] * n
+
+        batcher = MicroBatcher(call, max_size=8, max_wait=0.01)
+        self.assertEqual(batcher.submit("stage1"), "only")
+        self.assertEqual(calls, [("stage1", 1)])
+        self.assertEqual(batcher.open_batches, {})
+
+    def test_different_keys_are_not_merged(self):
+        calls = []
+        started = threading.Barrier(2)
+
+        def call(key, n):
+            calls.append((key, n))
+            return [key] * n
+
+        batcher = MicroBatcher(call, max_size=8, max_wait=0.05)
+
+        def submit(key):
+            started.wait()
+            return batcher.submit(key)
+
+        with ThreadPoolExecutor(2) as pool:
+            results = list(pool.map(submit, ["stage1", "stage2"]))
+
+        self.assertEqual(results, ["stage1", "stage2"])
+        self.assertEqual(sorted(calls), [("stage1", 1), ("stage2", 1)])
+
+    def test_short_batch_fails_only_the_waiters_without_a_result(self):
+        started = threading.Barrier(3)
+        batcher = MicroBatcher(
+            lambda key, n: ["a"],
+            max_size=3,
+            max_wait=5,
+            short_error=lambda: ValueError("short"),
+        )
+
+        def submit(_):
+            started.wait()
+            try:
+                return batcher.submit("stage1")
+            except ValueError as e:
+                return e
+
+        with ThreadPoolExecutor(3) as pool:
+            results = list(pool.map(submit, range(3)))
+
+        self.assertEqual(results.count("a"), 1)
+        errors = [r for r in results if isinstance(r, ValueError)]
+        self.assertEqual(len(errors), 2)
+
+    def test_call_error_reaches_every_waiter(self):
+        started = threading.Barrier(2)
+
+        def call(key, n):
+            raise ConnectionError("upstream down")
+
+        batcher = MicroBatcher(call, max_size=2, max_wait=5)
+
+        def submit(_):
+            started.wait()
+            with self.assertRaises(ConnectionError):
+                batcher.submit("stage1")
+
+        with ThreadPoolExecutor(2) as pool:
+            list(pool.map(submit, range(2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# 需要一个可用的 Redis：REDIS_URL=redis://localhost:6379/15 python -m unittest discover -s tests -t .
+# 没有设置 REDIS_URL 或未安装 redis 时跳过
+import math
+import os
+import unittest
+import uuid
+
+from token_bucket import TOKEN_BUCKET_LUA
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+CAPACITY = 2
+RATE_PER_MS = 1 / 60000  # 每分钟回填 1 次
+START_MS = 1_000_000
+
+
+@unittest.skipUnless(redis and REDIS_URL, "requires redis and REDIS_URL")
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.client = redis.Redis.from_url(REDIS_URL)
+        self.bucket = self.client.register_script(TOKEN_BUCKET_LUA)
+        self.key = f"test-rl-{uuid.uuid4().hex}"
+
+    def tearDown(self):
+        self.client.delete(self.key)
+
+    def take(self, now_ms):
+        return self.bucket(keys=[self.key], args=[CAPACITY, RATE_PER_MS, now_ms]) == 1
+
+    def test_burst_up_to_capacity_then_deny(self):
+        self.assertTrue(self.take(START_MS))
+        self.assertTrue(self.take(START_MS))
+        self.assertFalse(self.take(START_MS))
+
+    def test_refills_over_time(self):
+        self.take(START_MS)
+        self.take(START_MS)
+        self.assertFalse(self.take(START_MS + 30_000))
+        self.assertTrue(self.take(START_MS + 61_000))
+        self.assertFalse(self.take(START_MS + 61_000))
+
+    def test_refill_is_capped_at_capacity(self):
+        self.take(START_MS)
+        later = START_MS + 3_600_000
+        self.assertTrue(self.take(later))
+        self.assertTrue(self.take(later))
+        self.assertFalse(self.take(later))
+
+    def test_clock_going_backwards_does_not_drain_the_bucket(self):
+        self.take(START_MS)
+        self.assertTrue(self.take(START_MS - 600_000))
+
+    def test_key_expires_once_the_bucket_would_be_full(self):
+        self.take(START_MS)
+        ttl = self.client.pttl(self.key)
+        self.assertGreater(ttl, 0)
+        self.assertLessEqual(ttl, math.ceil(CAPACITY / RATE_PER_MS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+# 令牌桶 Lua 脚本：在 Redis 里原子地读取桶状态、按时间回填、扣减一次、写回并续期。
+# KEYS[1] 桶的 key；ARGV: 容量、每毫秒回填数量、当前时间（毫秒）。返回 1 放行、0 拒绝。
+# 桶闲置到回填满所需的时间后自动过期
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'last_refill')
+local tokens = tonumber(state[1]) or capacity
+local last_refill = tonumber(state[2]) or now
+-- 多个实例之间时钟可能有偏差，时间不倒退，避免回填量变成负数
+if now < last_refill then
+    now = last_refill
+end
+tokens = math.min(capacity, tokens + (now - last_refill) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'last_refill', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate))
+return allowed
+"""